@@ -1,84 +1,314 @@
-import csv
+import gzip
+import hashlib
 import logging
 import os
 from contextlib import asynccontextmanager
 from typing import List, Dict, Union
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+import numpy as np
+import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+from scipy.spatial import cKDTree
 import uvicorn
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("api")
 
-# Global storage for stars
-stars_db = []
+# Catalog files in order of preference
+CATALOG_FILES = ["star_data.arrow", "star_data.parquet", "star_data.csv"]
+# clean_data.py records a sha256 of these files, in this order, in the meta
+# file next to its outputs; keep this in sync with inputs_hash() there
+CATALOG_META_FILE = "star_data.parquet.meta"
+CATALOG_INPUT_FILES = ["clean_data.py", "star_data.csv", "star_name_data.json", "star_name_cross_reference.csv"]
+
+# Columns served by the API, in response order. Only these are read from disk.
+STAR_COLUMNS = [
+    "HR", "Name", "HD", "RAJ2000", "DEJ2000", "Vmag", "B-V", "SpType", "Parallax", "display_name",
+]
+STRING_COLUMNS = ["Name", "SpType", "display_name"]
+
+# Explicit schema so Arrow parses, casts and null-handles every cell in one pass
+CATALOG_TYPES = {
+    "HR": pa.int32(),
+    "HD": pa.int32(),
+    "RAJ2000": pa.float64(),
+    "DEJ2000": pa.float64(),
+    "Vmag": pa.float64(),
+    "B-V": pa.float64(),
+    "Parallax": pa.float64(),
+    # large_string matches what clean_data.py's polars writer emits
+    **{name: pa.large_string() for name in STRING_COLUMNS},
+}
+# Decimals the source catalog gives for these columns. They are stored in the
+# narrowest of QUANTIZED_TYPES that recovers every value to those decimals: float16
+# only does for small magnitudes (half its spacing exceeds 0.0005 from |x| >= 2 and
+# 0.005 from |x| >= 16), so clean_catalog checks each column and otherwise widens it.
+# clean_data.py makes the same choice for star_data.arrow; keep both in sync.
+QUANTIZED_DECIMALS = {"Vmag": 2, "B-V": 2, "Parallax": 3}
+QUANTIZED_TYPES = [pa.float16(), pa.float32()]
+# The schema served when every quantized column fits in float16
+CATALOG_SCHEMA = pa.schema([
+    (name, pa.float16() if name in QUANTIZED_DECIMALS else CATALOG_TYPES[name]) for name in STAR_COLUMNS
+])
+CSV_CONVERT_OPTIONS = pv.ConvertOptions(
+    column_types=CATALOG_TYPES,
+    include_columns=STAR_COLUMNS,
+    null_values=["", "NA"],
+    strings_can_be_null=True,
+)
+
+# Media type for clients that want the columnar catalog instead of JSON
+ARROW_STREAM_TYPE = "application/vnd.apache.arrow.stream"
+
+# Ensure essential coordinates exist, as a columnar predicate Arrow can push down
+HAS_COORDINATES = (
+    pc.field("RAJ2000").is_valid()
+    & pc.field("DEJ2000").is_valid()
+    & pc.field("Vmag").is_valid()
+)
+
+def quantize_column(name: str, column: pa.ChunkedArray) -> pa.ChunkedArray:
+    """
+    Casts a float64 column to the narrowest of QUANTIZED_TYPES whose values
+    round back to the original at the column's declared decimals.
+    Falls back to keeping float64, with a warning, when none of them do.
+    """
+    decimals = QUANTIZED_DECIMALS[name]
+    for quantized_type in QUANTIZED_TYPES:
+        quantized = pc.cast(column, quantized_type)
+        restored = pc.round(pc.cast(quantized, pa.float64()), ndigits=decimals)
+        if not (pc.sum(pc.not_equal(restored, column)).as_py() or 0):
+            return quantized
+    logger.warning(f"{name} values do not round-trip to {decimals} decimals through float32, keeping float64")
+    return column
+
+def is_served_schema(schema: pa.Schema) -> bool:
+    """
+    Returns whether schema is one clean_catalog could have produced, so a
+    table in it can be served without another pass.
+    """
+    if schema.names != STAR_COLUMNS:
+        return False
+    for field in schema:
+        allowed = [CATALOG_TYPES[field.name]]
+        if field.name in QUANTIZED_DECIMALS:
+            allowed += QUANTIZED_TYPES
+        if field.type not in allowed:
+            return False
+    return True
+
+def clean_catalog(table: pa.Table) -> pa.Table:
+    """
+    Normalizes a raw catalog table to the served schema.
+    Trims string columns, drops stars without usable coordinates and
+    quantizes the low-precision numeric columns (see quantize_column).
+    """
+    table = table.select(STAR_COLUMNS)
+    for name in STAR_COLUMNS:
+        column = table[name]
+        if column.type != CATALOG_TYPES[name]:
+            column = pc.cast(column, CATALOG_TYPES[name])
+        if name in STRING_COLUMNS:
+            # Clean string columns just in case, keeping empty strings rather than nulls
+            column = pc.fill_null(pc.utf8_trim_whitespace(column), "")
+        table = table.set_column(table.schema.get_field_index(name), name, column)
+
+    table = table.filter(HAS_COORDINATES)
+    for name in QUANTIZED_DECIMALS:
+        column = quantize_column(name, table[name])
+        table = table.set_column(table.schema.get_field_index(name), name, column)
+    return table
+
+def to_json_rows(table: pa.Table) -> List[Dict]:
+    """
+    Converts catalog rows to JSON-ready dicts.
+    Quantized columns are widened and rounded to the catalog's decimals, so
+    clients see 2.53 rather than 2.529296875; float64 ones are left exact.
+    """
+    for name, decimals in QUANTIZED_DECIMALS.items():
+        if table.schema.field(name).type == pa.float64():
+            continue
+        column = pc.round(pc.cast(table[name], pa.float64()), ndigits=decimals)
+        table = table.set_column(table.schema.get_field_index(name), name, column)
+    return table.to_pylist()
+
+def artifacts_are_current(data_dir: str) -> bool:
+    """
+    Returns whether the files written by clean_data.py were built from the
+    inputs currently in data_dir, by recomputing the hash it recorded.
+    """
+    meta_path = os.path.join(data_dir, CATALOG_META_FILE)
+    digest = hashlib.sha256()
+    try:
+        with open(meta_path) as f:
+            recorded = f.read().strip()
+        for file_name in CATALOG_INPUT_FILES:
+            with open(os.path.join(data_dir, file_name), "rb") as f:
+                digest.update(f.read())
+    except OSError:
+        return False
+    return digest.hexdigest() == recorded
+
+def find_catalog(data_dir: str) -> Union[str, None]:
+    """
+    Returns the preferred catalog file in data_dir, or None if there is none.
+    The Arrow IPC and Parquet files written by clean_data.py are preferred
+    over re-parsing the CSV, but only while they match their inputs.
+    """
+    current = None
+    for file_name in CATALOG_FILES:
+        path = os.path.join(data_dir, file_name)
+        if not os.path.exists(path):
+            continue
+        if file_name != "star_data.csv":
+            if current is None:
+                current = artifacts_are_current(data_dir)
+            if not current:
+                logger.warning(f"{path} is out of date with its inputs, rerun clean_data.py; skipping it")
+                continue
+        return path
+    return None
+
+def read_catalog(path: str) -> pa.Table:
+    """Reads a raw catalog table from an Arrow IPC, Parquet or CSV file."""
+    if path.endswith(".arrow"):
+        # Uncompressed IPC buffers are zero-copy views of the memory-mapped file
+        return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    if path.endswith(".parquet"):
+        return pq.read_table(path, memory_map=True, columns=STAR_COLUMNS, filters=HAS_COORDINATES)
+    return pv.read_csv(path, convert_options=CSV_CONVERT_OPTIONS)
+
+def load_catalog(path: str) -> pa.Table:
+    """
+    Loads the served catalog table from path.
+    clean_data.py writes star_data.arrow already in a served schema, so that
+    table is used as-is and keeps pointing at the mapped file: every worker
+    shares the same page-cache pages. Any other source goes through
+    clean_catalog, which builds a private copy per worker.
+    """
+    table = read_catalog(path)
+    if path.endswith(".arrow") and is_served_schema(table.schema):
+        return table
+    return clean_catalog(table)
+
+def serialize_arrow_stream(table: pa.Table) -> bytes:
+    """Serializes a table to the Arrow IPC streaming format."""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def header_qualities(header: str) -> Dict[str, float]:
+    """
+    Parses a comma-separated Accept-style header into {value: q}.
+    Values without a q parameter get 1.0, and unparsable q-values get 0.
+    """
+    qualities = {}
+    for entry in header.split(","):
+        value, _, params = entry.partition(";")
+        value = value.strip().lower()
+        if not value:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, q = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(q)
+                except ValueError:
+                    quality = 0.0
+        qualities[value] = quality
+    return qualities
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """
+    Returns whether an Accept-Encoding header allows a gzip response.
+    An explicit gzip entry wins over "*", and q=0 means not acceptable.
+    """
+    qualities = header_qualities(accept_encoding)
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+def prefers_arrow(accept: str) -> bool:
+    """
+    Returns whether an Accept header asks for the Arrow IPC stream over JSON.
+    Arrow must be listed explicitly with q > 0 and rank at least as high as
+    JSON (matched exactly, via application/* or via */*).
+    """
+    qualities = header_qualities(accept)
+    arrow = qualities.get(ARROW_STREAM_TYPE, 0.0)
+    json = qualities.get("application/json", qualities.get("application/*", qualities.get("*/*", 0.0)))
+    return arrow > 0 and arrow >= json
+
+def etag_matches(if_none_match: Union[str, None], etag: str) -> bool:
+    """Returns whether an If-None-Match header matches etag (weak comparison)."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+def unit_vectors(ra, dec) -> np.ndarray:
+    """Converts RA/Dec arrays in degrees to unit vectors on the celestial sphere."""
+    ra, dec = np.deg2rad(ra), np.deg2rad(dec)
+    return np.column_stack([np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)])
+
+def build_sky_index(ra, dec) -> cKDTree:
+    """
+    Builds a KD-tree over the stars' unit vectors for cone searches.
+    An angular radius maps to a straight-line (chord) distance between unit
+    vectors, so a ball query on the tree finds every star inside the cone.
+    """
+    return cKDTree(unit_vectors(ra, dec))
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
     Lifespan context manager to handle startup and shutdown events.
-    Loads CSV data into memory when the app starts.
+    Loads star data into memory when the app starts.
+    The served table is kept columnar on app.state, next to the bodies and
+    the sky index derived from it, so handlers never mix tables.
     """
-    global stars_db
-    
-    # Locate the CSV file in the 'src/data' folder
+    stars_db = CATALOG_SCHEMA.empty_table()
+
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    csv_file = os.path.join(current_dir, "..", "src", "data", "star_data.csv")
-    
-    if os.path.exists(csv_file):
+    data_dir = os.path.join(current_dir, "..", "src", "data")
+    source_file = find_catalog(data_dir)
+
+    if source_file:
         try:
-            with open(csv_file, mode="r", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                # Clean headers just in case
-                reader.fieldnames = [name.strip() for name in reader.fieldnames]
-                
-                def safe_float(v):
-                    try:
-                        return float(v)
-                    except (ValueError, TypeError):
-                        return None
-
-                def safe_int(v):
-                    try:
-                        return int(v)
-                    except (ValueError, TypeError):
-                        return None
-
-                for row in reader:
-                    try:
-                        star = {
-                            "HR": safe_int(row.get("HR")),
-                            "Name": row.get("Name", "").strip(),
-                            "HD": safe_int(row.get("HD")),
-                            "ADS": row.get("ADS", "").strip(),
-                            "VarID": row.get("VarID", "").strip(),
-                            "RAJ2000": safe_float(row.get("RAJ2000")),
-                            "DEJ2000": safe_float(row.get("DEJ2000")),
-                            "Vmag": safe_float(row.get("Vmag")),
-                            "B-V": safe_float(row.get("B-V")),
-                            "SpType": row.get("SpType", "").strip(),
-                            "NoteFlag": row.get("NoteFlag", "").strip(),
-                            "Parallax": safe_float(row.get("Parallax")),
-                            "n_Parallax": row.get("n_Parallax", "").strip(),
-                            "display_name": row.get("display_name", "").strip()
-                        }
-                        
-                        # Ensure essential coordinates exist
-                        if star["RAJ2000"] is not None and star["DEJ2000"] is not None and star["Vmag"] is not None:
-                            stars_db.append(star)
-                    except Exception:
-                        continue
-                        
-            logger.info(f"Successfully loaded {len(stars_db)} stars into memory from {csv_file}.")
+            stars_db = load_catalog(source_file)
+
+            logger.info(f"Successfully loaded {stars_db.num_rows} stars into memory from {source_file}.")
         except Exception as e:
-            logger.error(f"Error loading CSV data: {e}")
+            logger.error(f"Error loading star data: {e}")
     else:
-        logger.warning(f"CSV file not found at: {csv_file}")
+        logger.warning(f"Star data not found in: {data_dir}")
+
+    app.state.stars_db = stars_db
+
+    # The catalog is immutable after startup, so serialize the response bodies once.
+    # Row dicts are only built here for the JSON encoder and then dropped.
+    app.state.stars_json = orjson.dumps(to_json_rows(stars_db))
+    # mtime=0 keeps the gzip header, and so its ETag, identical across workers and restarts
+    app.state.stars_gzip = gzip.compress(app.state.stars_json, mtime=0)
+    app.state.stars_etag = f'"{hashlib.sha256(app.state.stars_json).hexdigest()}"'
+    # Each content-coding is a different representation, so it gets its own strong ETag
+    app.state.stars_gzip_etag = f'"{hashlib.sha256(app.state.stars_gzip).hexdigest()}"'
+    app.state.stars_arrow = serialize_arrow_stream(stars_db)
+    app.state.stars_arrow_etag = f'"{hashlib.sha256(app.state.stars_arrow).hexdigest()}"'
+
+    # Index positions once so cone searches don't scan every star
+    app.state.star_tree = build_sky_index(stars_db["RAJ2000"].to_numpy(), stars_db["DEJ2000"].to_numpy())
     
     yield
-    stars_db.clear()
+    # Release the table and its index together so they never disagree
+    app.state.stars_db = CATALOG_SCHEMA.empty_table()
+    app.state.star_tree = build_sky_index(np.empty(0), np.empty(0))
 
 app = FastAPI(title="SkyTrackr API", lifespan=lifespan)
 
@@ -92,10 +322,53 @@ app.add_middleware(
 )
 
 @app.get("/stars")
-async def get_stars():
-    """Returns the list of loaded stars."""
-    return stars_db
+async def get_stars(request: Request):
+    """
+    Returns the list of loaded stars.
+    Clients that accept Arrow IPC streams get the columnar catalog instead of JSON.
+    """
+    state = request.app.state
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if prefers_arrow(request.headers.get("accept", "")):
+        content, etag, media_type = state.stars_arrow, state.stars_arrow_etag, ARROW_STREAM_TYPE
+    elif accepts_gzip(request.headers.get("accept-encoding", "")):
+        content, etag, media_type = state.stars_gzip, state.stars_gzip_etag, "application/json"
+        headers["Content-Encoding"] = "gzip"
+    else:
+        content, etag, media_type = state.stars_json, state.stars_etag, "application/json"
+
+    headers["ETag"] = etag
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        headers.pop("Content-Encoding", None)
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=content, media_type=media_type, headers=headers)
+
+@app.get("/stars/near")
+async def get_stars_near(
+    request: Request,
+    ra: float = Query(..., ge=0, lt=360, description="Right Ascension in degrees"),
+    dec: float = Query(..., ge=-90, le=90, description="Declination in degrees"),
+    radius: float = Query(..., gt=0, le=180, description="Search radius in degrees"),
+):
+    """Returns the loaded stars within radius degrees of (ra, dec), in catalog order."""
+    state = request.app.state
+    center = unit_vectors([ra], [dec])[0]
+    chord = 2 * np.sin(np.deg2rad(radius) / 2)
+    # The tree's indices refer to rows of the table it was built from
+    indices = pa.array(sorted(state.star_tree.query_ball_point(center, chord)), type=pa.int64())
+    return Response(content=orjson.dumps(to_json_rows(state.stars_db.take(indices))), media_type="application/json")
 
 if __name__ == "__main__":
-    # Run the app with uvicorn when executed directly
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # Run the app with uvicorn when executed directly.
+    # /stars is read-only, so it scales with one worker per core; reload is off
+    # because its file watcher cannot be combined with multiple workers.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=os.cpu_count(),
+        loop="uvloop",
+        http="httptools",
+        reload=False,
+    )
\ No newline at end of file
@@ -1,20 +1,61 @@
-import pandas as pd
+import polars as pl
+import hashlib
 import json
 import requests
 import os
+import sys
 
 # Get the absolute path of the directory where the script is located
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
 # Construct absolute paths for the data files
 star_data_path = os.path.join(script_dir, "star_data.csv")
+star_parquet_path = os.path.join(script_dir, "star_data.parquet")
+star_arrow_path = os.path.join(script_dir, "star_data.arrow")
+star_meta_path = os.path.join(script_dir, "star_data.parquet.meta")
 star_name_data_path = os.path.join(script_dir, "star_name_data.json")
 hd_cross_reference_path = os.path.join(script_dir, "star_name_cross_reference.csv")
 
+def inputs_hash():
+    """
+    Hash the input files together with this script, so the outputs are only
+    rebuilt when the data or the feature engineering below changes.
+    The backend recomputes this over the same files (CATALOG_INPUT_FILES in
+    backend/main.py) to detect stale outputs, so keep the two in sync.
+    """
+    digest = hashlib.sha256()
+    for path in (os.path.abspath(__file__), star_data_path, star_name_data_path, hd_cross_reference_path):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+## skip the rebuild if the outputs were generated from these exact inputs
+input_key = inputs_hash()
+if os.path.exists(star_parquet_path) and os.path.exists(star_arrow_path) and os.path.exists(star_meta_path):
+    with open(star_meta_path) as f:
+        if f.read().strip() == input_key:
+            print("star_data outputs are up to date, skipping")
+            sys.exit(0)
+
 ## read our two files
-stars_df = pd.read_csv(star_data_path)
-star_names_df = pd.read_json(star_name_data_path)
-hd_cross_reference_df = pd.read_csv(hd_cross_reference_path)
+# HD is an Int64 in all three tables so lookups are integer hash joins
+stars = pl.scan_csv(star_data_path, infer_schema_length=None, schema_overrides={'HD': pl.Int64})
+# Only the first entry per HD is used for lookups; names without an HD ("_") are dropped
+star_names = (
+    pl.read_json(star_name_data_path).lazy()
+    .select(pl.col('HD').cast(pl.Int64, strict=False), pl.col('Name/ASCII').alias('catalog_name'))
+    .drop_nulls('HD')
+    .unique(subset='HD', keep='first', maintain_order=True)
+)
+# Fl is read as a float, the dtype the existing display names were generated with
+hd_cross_reference = (
+    pl.scan_csv(
+        hd_cross_reference_path, infer_schema_length=None, schema_overrides={'HD': pl.Int64, 'Fl': pl.Float64}
+    )
+    .select('HD', 'Bayer', 'Cst', 'Fl', 'DM')
+    .unique(subset='HD', keep='first', maintain_order=True)
+    .with_columns(pl.col('Bayer', 'Cst', 'DM').str.strip_chars())
+)
 
 ####################################################################
 ############# FEATURE ENGINEER DISPLAY NAME COL ####################
@@ -52,63 +93,127 @@ constellation_mapping = {
     "Eri": "Eridanus", "Cet": "Cetus", "Tau": "Taurus", "Per": "Perseus", "Aur": "Auriga",
     "Cam": "Camelopardalis", "And": "Andromeda", "Tri": "Triangulum", "Ari": "Aries", "Psc": "Piscis",
     "UMa": "Ursa Major", "UMi": "Ursa Minor", "Dra": "Draco", "Cep": "Cepheus", "Cas": "Cassiopeia",
-    "Lyn": "Lynx", "Gem": "Gemini", "Cnc": "Cancer", "Leo": "Leo", "UMa": "Ursa Major", "CVn": "Canes Venatici",
+    "Lyn": "Lynx", "Gem": "Gemini", "Cnc": "Cancer", "Leo": "Leo", "CVn": "Canes Venatici",
     "Com": "Coma Berenices", "Boo": "Boötes", "Cen": "Centaurus", "Lup": "Lupus", "Vir": "Virgo",
     "Lib": "Libra", "Sco": "Scorpius", "Oph": "Ophiuchus", "Sgr": "Sagittarius", "Sct": "Scutum",
-    "Aql": "Aquila", "Lyr": "Lyra", "Cyg": "Cygnus", "Peg": "Pegasus", "Cap": "Capella", "Aur": "Auriga"
+    "Aql": "Aquila", "Lyr": "Lyra", "Cyg": "Cygnus", "Peg": "Pegasus", "Cap": "Capricornus"
 }
 
-def get_display_name(hd):
+def remap_categories(column, remapped):
+    """
+    Remap a string column through a {category: replacement} dict.
+    The column is encoded as an Enum over the dict keys and each physical
+    code indexes the replacement list, so lookups run once per category.
+    """
+    replacements = pl.Series(list(remapped.values()), dtype=pl.String)
+    return pl.lit(replacements).gather(column.cast(pl.Enum(list(remapped))).to_physical())
+
+def reference_categories(name):
+    """Returns the distinct non-null values of a hd_cross_reference column."""
+    return (
+        hd_cross_reference.select(pl.col(name).drop_nulls().unique().sort())
+        .collect()
+        .to_series()
+        .to_list()
+    )
+
+# Reformat the (small) set of distinct Bayer/Cst values instead of every row
+bayer_categories = {b: bayer_mapping.get(b.lower(), b) for b in reference_categories('Bayer')}
+cst_categories = {c: constellation_mapping.get(c, c) for c in reference_categories('Cst')}
+
+def display_name_expr():
     """
     Feature engineer the display_name for a star based on its HD number.
-    Follows the priority order specified in the comments above.
+    Follows the priority order specified in the comments above, evaluated
+    as a single expression over stars joined with both reference tables.
     """
-    # Convert HD to string for comparison
-    hd_str = str(int(hd)) if pd.notna(hd) else None
-    
-    if hd_str is None:
-        return "Star does not exist"
-    
-    # 1) Check if HD exists in star_names_df
-    matching_name = star_names_df[star_names_df['HD'] == hd_str]
-    if not matching_name.empty:
-        name = matching_name.iloc[0].get('Name/ASCII', '')
-        if pd.notna(name) and name.strip():
-            return name
-    
-    # 2) Check if HD exists in hd_cross_reference_df
-    matching_hd = hd_cross_reference_df[hd_cross_reference_df['HD'] == int(hd_str)]
-    if not matching_hd.empty:
-        row = matching_hd.iloc[0]
-        bayer = row['Bayer'] if 'Bayer' in row.index else ''
-        cst = row['Cst'] if 'Cst' in row.index else ''
-        fl = row['Fl'] if 'Fl' in row.index else ''
-        dm = row['DM'] if 'DM' in row.index else ''
-        
-        # 2) Try Bayer + Constellation
-        if pd.notna(bayer) and str(bayer).strip() and pd.notna(cst) and str(cst).strip():
-            bayer_reform = bayer_mapping.get(str(bayer).strip().lower(), str(bayer).strip())
-            cst_reform = constellation_mapping.get(str(cst).strip(), str(cst).strip())
-            return f"{bayer_reform} {cst_reform}"
-        
-        # 3) Try Fl + Constellation
-        if pd.notna(fl) and str(fl).strip() and fl != '':
-            cst_reform = constellation_mapping.get(str(cst).strip(), str(cst).strip()) if pd.notna(cst) else ''
-            return f"{fl} {cst_reform}".strip()
-        
-        # 4) Check if DM designation ends with a letter
-        if pd.notna(dm) and str(dm).strip():
-            dm_str = str(dm).strip()
-            if dm_str and dm_str[-1].isalpha():
-                cst_reform = constellation_mapping.get(str(cst).strip(), str(cst).strip()) if pd.notna(cst) else ''
-                return f"{cst_reform} {dm_str[-1]}".strip()
-    
-    # 5) Just use HD number
-    return f"HD {hd_str}"
+    name = pl.col('catalog_name')
+    bayer = pl.col('Bayer')
+    cst = pl.col('Cst')
+    dm_last = pl.col('DM').str.slice(-1)
+
+    bayer_reform = remap_categories(bayer, bayer_categories)
+    cst_reform = remap_categories(cst, cst_categories).fill_null('')
+
+    return (
+        pl.when(pl.col('HD').is_null())
+        .then(pl.lit("Star does not exist"))
+        # 1) Name from star_names
+        .when(name.str.strip_chars() != '')
+        .then(name)
+        # 2) Bayer + Constellation
+        .when((bayer != '') & (cst != ''))
+        .then(pl.concat_str([bayer_reform, cst_reform], separator=' '))
+        # 3) Fl + Constellation
+        .when(pl.col('Fl').is_not_null())
+        .then(pl.concat_str([pl.col('Fl').cast(pl.String), cst_reform], separator=' ').str.strip_chars())
+        # 4) Constellation + trailing DM letter
+        .when(dm_last.str.contains(r'^\p{L}$'))
+        .then(pl.concat_str([cst_reform, dm_last], separator=' ').str.strip_chars())
+        # 5) Just use HD number
+        .otherwise(pl.concat_str([pl.lit('HD '), pl.col('HD').cast(pl.String)]))
+    )
 
 # Apply the display_name feature engineering
-stars_df['display_name'] = stars_df['HD'].apply(get_display_name)
+stars_lf = (
+    stars
+    .join(star_names, on='HD', how='left', maintain_order='left')
+    .join(hd_cross_reference, on='HD', how='left', maintain_order='left')
+    .with_columns(display_name=display_name_expr())
+    .drop('catalog_name', 'Bayer', 'Cst', 'Fl', 'DM')
+)
+
+# The API's served table (CATALOG_SCHEMA in backend/main.py): selected columns,
+# trimmed strings, stars with coordinates and float16 magnitudes/colour/parallax.
+# Writing star_data.arrow in this shape lets API workers use the mapped file as-is.
+served_stars = stars_lf.drop_nulls(['RAJ2000', 'DEJ2000', 'Vmag'])
+
+# Store each low-precision column in the narrowest float that gives back the catalog's decimals;
+# float16 only holds them for small values. Mirrors QUANTIZED_DECIMALS/QUANTIZED_TYPES and
+# quantize_column in backend/main.py, which keep the same choice for other sources; keep both in sync.
+quantized_decimals = {'Vmag': 2, 'B-V': 2, 'Parallax': 3}
+quantized_types = [pl.Float16, pl.Float32]
+lossy = (
+    served_stars
+    .select(
+        (pl.col(name).cast(dtype).cast(pl.Float64).round(decimals) != pl.col(name)).sum().alias(f"{name}:{dtype}")
+        for name, decimals in quantized_decimals.items()
+        for dtype in quantized_types
+    )
+    .collect(engine='streaming')
+    .row(0, named=True)
+)
+quantized_dtypes = {}
+for name, decimals in quantized_decimals.items():
+    quantized_dtypes[name] = next((dtype for dtype in quantized_types if not lossy[f"{name}:{dtype}"]), pl.Float64)
+    if quantized_dtypes[name] == pl.Float64:
+        print(f"Warning: {name} values do not round-trip to {decimals} decimals through Float32, keeping Float64")
+
+served_lf = served_stars.select(
+    pl.col('HR').cast(pl.Int32),
+    pl.col('Name').str.strip_chars().fill_null(''),
+    pl.col('HD').cast(pl.Int32),
+    'RAJ2000',
+    'DEJ2000',
+    pl.col('Vmag').cast(quantized_dtypes['Vmag']),
+    pl.col('B-V').cast(quantized_dtypes['B-V']),
+    pl.col('SpType').str.strip_chars().fill_null(''),
+    pl.col('Parallax').cast(quantized_dtypes['Parallax']),
+    pl.col('display_name').str.strip_chars().fill_null(''),
+)
 
-# Save the updated DataFrame back to the CSV file
-stars_df.to_csv(star_data_path, index=False)
+# Stream the results in batches straight to disk so memory stays bounded for large catalogs:
+# the full table as Parquet, plus the served table as an uncompressed Arrow IPC file
+pl.collect_all(
+    [
+        stars_lf.sink_parquet(star_parquet_path, compression="zstd", lazy=True),
+        served_lf.sink_ipc(
+            star_arrow_path, compression="uncompressed", compat_level=pl.CompatLevel.oldest(), lazy=True
+        ),
+    ],
+    engine='streaming',
+)
 
+# Record which inputs the outputs were built from
+with open(star_meta_path, "w") as f:
+    f.write(input_key)